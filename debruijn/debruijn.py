@@ -24,23 +24,40 @@ __status__ = "Developpement"
 
 
 import argparse
+import heapq
 import itertools
 import os
 from pathlib import Path
-import random
-import statistics
 import sys
-import textwrap
-from typing import Iterator, Dict, List
+from typing import Iterable, Iterator, Dict, List, Tuple, Union
 from networkx import (
     DiGraph,
-    all_simple_paths,
-    lowest_common_ancestor,
-    has_path,
-    isolates
+    ancestors,
+    descendants,
+    is_directed_acyclic_graph,
+    restricted_view,
+    topological_sort
 )
-
-random.seed(9001)
+try:
+    from .kmer_counting import count_kmers, read_sequences
+except ImportError:
+    # Run as a script, or imported from its directory as by the tests
+    from kmer_counting import count_kmers, read_sequences
+
+try:
+    from joblib import Parallel, delayed
+except ImportError:  # pragma: no cover
+    Parallel = None
+else:
+    try:
+        # Vendored by joblib before 1.6, a dependency since
+        from joblib.externals import cloudpickle
+    except ImportError:
+        import cloudpickle
+
+_COMPLEMENT = str.maketrans("ACGT", "TGCA")
+# Number of nucleotides per line of the output fasta file
+_LINE_WIDTH = 80
 
 
 def isfile(path: str) -> Path:  # pragma: no cover
@@ -98,6 +115,26 @@ def get_arguments():  # pragma: no cover
         type=Path,
         help="Save graph as an image (png)"
     )
+    parser.add_argument(
+        "-j",
+        dest="n_jobs",
+        type=int,
+        default=1,
+        help="Number of parallel jobs to evaluate bubbles, -1 for all cores "
+             "(default 1, requires joblib)"
+    )
+    parser.add_argument(
+        "-c",
+        dest="canonical",
+        action="store_true",
+        help="Count canonical k-mers, reads coming from both strands"
+    )
+    parser.add_argument(
+        "-s",
+        dest="drop_singletons",
+        action="store_true",
+        help="Drop k-mers seen only once, mostly sequencing errors"
+    )
     return parser.parse_args()
 
 
@@ -107,16 +144,8 @@ def read_fastq(fastq_file: Path) -> Iterator[str]:
     :param fastq_file: (Path) Path to the fastq file.
     :return: A generator object that iterates over the read sequences.
     """
-    with fastq_file.open('r') as file:
-        while True:
-            try:
-                next(file)                     # Read header
-                sequence = next(file).strip()  # Read sequence
-                next(file)                     # Skip plus line
-                next(file)                     # Skip quality line
-                yield sequence
-            except StopIteration:
-                break
+    for sequence in read_sequences(fastq_file):
+        yield sequence.decode()
 
 
 def cut_kmer(read: str, kmer_size: int) -> Iterator[str]:
@@ -129,31 +158,52 @@ def cut_kmer(read: str, kmer_size: int) -> Iterator[str]:
         yield read[i : i + kmer_size]
 
 
-def build_kmer_dict(fastq_file: Path, kmer_size: int) -> Dict[str, int]:
+def build_kmer_dict(fastq_file: Path, kmer_size: int,
+                    canonical: bool = False,
+                    drop_singletons: bool = False) -> Dict[str, int]:
     """Build a dictionnary object of all kmer occurrences in the fastq file
 
+    Kmers are counted as 2-bit packed integers, see kmer_counting.
+
     :param fastq_file: (str) Path to the fastq file.
+    :param canonical: (bool) Count each kmer with its reverse complement,
+                      under the smallest of both
+    :param drop_singletons: (bool) Leave out kmers seen only once
     :return: A dictionnary object that identify all kmer occurrences.
     """
-    kmer_dict = {}
-    for read in read_fastq(fastq_file):
-        for kmer in cut_kmer(read, kmer_size):
-            if kmer in kmer_dict:
-                kmer_dict[kmer] += 1
-            else:
-                kmer_dict[kmer] = 1
-    return kmer_dict
+    return count_kmers(fastq_file, kmer_size, canonical, drop_singletons)
+
+
+def _reverse_complement(sequence: str) -> str:
+    """Get the reverse complement of a nucleotide sequence.
+
+    :param sequence: (str) Nucleotide sequence
+    :return: (str) Reverse complement of the sequence
+    """
+    return sequence.translate(_COMPLEMENT)[::-1]
 
 
-def build_graph(kmer_dict: Dict[str, int]) -> DiGraph:
+def build_graph(kmer_dict: Dict[str, int],
+                canonical: bool = False) -> DiGraph:
     """Build the debruijn graph
 
     :param kmer_dict: A dictionnary object that identify all kmer occurrences.
+    :param canonical: (bool) Kmers are canonical, add the reverse complement
+                      of each kmer with the same weight
     :return: A directed graph of all kmer substring and weight (occurrence).
     """
+    kmers = kmer_dict.items()
+    if canonical:
+        # Both strands are assembled, as they were counted together
+        kmers = ((strand, weight) for kmer, weight in kmer_dict.items()
+                 for strand in (kmer, _reverse_complement(kmer)))
     graph = DiGraph()
-    for kmer, weight in kmer_dict.items():
-        graph.add_edge(kmer[:-1], kmer[1:], weight=weight)
+    # Insert all edges in one call rather than one add_edge per kmer.
+    # Interning shares one string per node, rather than one per kmer it is
+    # cut from, across the adjacency dictionnaries of the graph
+    graph.add_edges_from((sys.intern(kmer[:-1]), sys.intern(kmer[1:]),
+                          {"weight": weight})
+                         for kmer, weight in kmers)
     return graph
 
 
@@ -167,25 +217,59 @@ def remove_paths(graph: DiGraph, path_list: List[List[str]],
     :param delete_sink_node: (boolean) True -> Remove the last node of a path
     :return: (nx.DiGraph) A directed graph object
     """
+    nodes_to_remove = set()
+    edges_to_remove = set()
     for path in path_list:
         for i in range(len(path) - 1):
-            # Check if the node exists before trying to remove it
-            if delete_entry_node and i == 0 and path[i] in graph:
-                graph.remove_node(path[i])
-            elif delete_sink_node and i == len(path) - 2 and path[i+1] in graph:
-                graph.remove_node(path[i+1])
+            if delete_entry_node and i == 0:
+                nodes_to_remove.add(path[i])
+            elif delete_sink_node and i == len(path) - 2:
+                nodes_to_remove.add(path[i+1])
             else:
-                # Check if the edge exists and remove it
-                if graph.has_edge(path[i], path[i+1]):
-                    graph.remove_edge(path[i], path[i+1])
+                edges_to_remove.add((path[i], path[i+1]))
+
+    # Only the ends of removed edges and the neighbors of removed nodes can
+    # be left isolated, rather than any node of the graph
+    candidates = {node for edge in edges_to_remove for node in edge}
+    for node in nodes_to_remove:
+        if node in graph:
+            candidates.update(graph.predecessors(node))
+            candidates.update(graph.successors(node))
+
+    # Bulk removals skip the nodes and edges that are already gone
+    graph.remove_edges_from(edges_to_remove)
+    graph.remove_nodes_from(nodes_to_remove)
 
     # Remove isolated nodes after edge removals
-    isolated_nodes = list(isolates(graph))
-    graph.remove_nodes_from(isolated_nodes)
+    graph.remove_nodes_from([node for node in candidates
+                             if node in graph and graph.degree(node) == 0])
 
     return graph
 
 
+def _best_path_index(path_list: List[List[str]], path_length: List[int],
+                     weight_avg_list: List[float]) -> int:
+    """Find the index of the best path between different paths
+
+    :param path_list: (list) A list of paths
+    :param path_length: (list) A list of lengths of each path
+    :param weight_avg_list: (list) A list of average weights of each path
+    :return: (int) Index of the best path
+    """
+    # Compare based on stdev of the average weight. It is positive as soon
+    # as two values differ, which is checked exactly without computing it
+    if (len(weight_avg_list) > 1
+            and max(weight_avg_list) > min(weight_avg_list)):
+        # Select path with the highest average weight
+        return weight_avg_list.index(max(weight_avg_list))
+    if len(path_length) > 1 and max(path_length) > min(path_length):
+        # If weights are equal, compare path lengths
+        return path_length.index(max(path_length))
+    # If both weights and lengths are equal, keep the smallest path so
+    # that the choice is reproducible
+    return min(range(len(path_list)), key=lambda i: tuple(path_list[i]))
+
+
 def select_best_path(graph: DiGraph, path_list: List[List[str]],
                      path_length: List[int], weight_avg_list: List[float],
                      delete_entry_node: bool = False,
@@ -200,16 +284,8 @@ def select_best_path(graph: DiGraph, path_list: List[List[str]],
     :param delete_sink_node: (bool) True -> Remove the last node of a path
     :return: (nx.DiGraph) A directed graph object
     """
-    # Compare based on stdev of the average weight
-    if len(weight_avg_list) > 1 and statistics.stdev(weight_avg_list) > 0:
-        # Select path with the highest average weight
-        best_path_index = weight_avg_list.index(max(weight_avg_list))
-    elif len(path_length) > 1 and statistics.stdev(path_length) > 0:
-        # If weights are equal, compare path lengths
-        best_path_index = path_length.index(max(path_length))
-    else:
-        # If both weights and lengths are equal, choose randomly
-        best_path_index = random.randint(0, len(path_list) - 1)
+    best_path_index = _best_path_index(path_list, path_length,
+                                       weight_avg_list)
 
     # Remove non-best paths
     paths_to_remove = [path for i, path in enumerate(path_list)
@@ -229,9 +305,113 @@ def path_average_weight(graph: DiGraph, path: List[str]) -> float:
     :param path: (list) A path consist of a list of nodes
     :return: (float) The average weight of a path
     """
-    return statistics.mean(
-        [d["weight"] for (u, v, d) in graph.subgraph(path).edges(data=True)]
-    )
+    # Only the edges along the path count, not every edge between its nodes
+    return sum(
+        graph[node][successor]["weight"]
+        for node, successor in zip(path, path[1:])
+    ) / (len(path) - 1)
+
+
+def _weighted_simple_paths(
+    graph: DiGraph, source: str, targets: set, nodes: set,
+    rank: Dict[str, int] = None
+    ) -> Iterator[Tuple[Tuple[str, ...], float]]:
+    """Generate the simple paths to some targets with their average weight.
+
+    Same depth-first search as all_simple_paths, except that it never
+    leaves the given nodes, so that branches that cannot reach a target
+    are not explored. The weight of the current path is summed as it is
+    extended, so paths sharing a prefix share its sum.
+
+    :param graph: (nx.DiGraph) A directed graph object
+    :param source: (str) First node of the paths
+    :param targets: (set) Nodes ending a path when reached
+    :param nodes: (set) Nodes the paths may go through
+    :param rank: (dict) Rank of the nodes, to only follow edges going
+                 forward, see _acyclic_ranks
+    :return: A generator object of (path as a tuple, average weight)
+    """
+    path = [source]
+    # Total weight of the path up to each of its nodes
+    weight_sums = [0]
+    visited = {source}
+    stack = [iter(graph.successors(source))]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            weight_sums.pop()
+            visited.discard(path.pop())
+        elif node not in visited and (rank is None
+                                      or rank[path[-1]] < rank[node]):
+            weight_sum = weight_sums[-1] + graph[path[-1]][node]["weight"]
+            if node in targets:
+                yield tuple(path) + (node,), weight_sum / len(path)
+            if node in nodes:
+                weight_sums.append(weight_sum)
+                path.append(node)
+                visited.add(node)
+                stack.append(iter(graph.successors(node)))
+
+
+def _stretches_off_path(path: Tuple[str, ...],
+                        path_edges: set) -> Iterator[Tuple[str, ...]]:
+    """Cut a path into the stretches that do not share edges with another.
+
+    Paths of a bubble may share edges with the best one, only the stretches
+    leaving it are removed so that the best path stays whole.
+
+    :param path: (tuple) A path in the graph
+    :param path_edges: (set) Edges of the other path
+    :return: A generator object of the stretches as tuples
+    """
+    stretch = [path[0]]
+    for edge in zip(path, path[1:]):
+        if edge not in path_edges:
+            stretch.append(edge[1])
+            continue
+        if len(stretch) > 1:
+            yield tuple(stretch)
+        stretch = [edge[1]]
+    if len(stretch) > 1:
+        yield tuple(stretch)
+
+
+def _bubble_paths_to_remove(graph: DiGraph,
+                            ancestor_node: str,
+                            descendant_node: str,
+                            nodes: set,
+                            rank: Dict[str, int] = None
+                            ) -> List[Tuple[str, ...]]:
+    """Find the paths of a bubble that are not the best one.
+
+    The graph is only read, so that independent bubbles can be evaluated
+    concurrently.
+
+    :param graph: (nx.DiGraph) A directed graph object
+    :param ancestor_node: (str) An upstream node in the graph
+    :param descendant_node: (str) A downstream node in the graph
+    :param nodes: (set) Nodes lying on a path between the two ends
+    :param rank: (dict) Rank of the nodes, see _weighted_simple_paths
+    :return: (list) A list of paths to remove
+    """
+    # Find all simple paths between the ancestor and descendant, with
+    # their average weight
+    all_paths, weight_avgs = [], []
+    for path, weight_avg in _weighted_simple_paths(graph, ancestor_node,
+                                                   {descendant_node}, nodes,
+                                                   rank):
+        all_paths.append(path)
+        weight_avgs.append(weight_avg)
+    # Compute the length of each path
+    path_lengths = [len(path) for path in all_paths]
+    # Choose the best path, all the others are removed
+    best_path_index = _best_path_index(all_paths, path_lengths, weight_avgs)
+    best_path = all_paths[best_path_index]
+    best_edges = set(zip(best_path, best_path[1:]))
+    return [stretch for i, path in enumerate(all_paths)
+            if i != best_path_index
+            for stretch in _stretches_off_path(path, best_edges)]
 
 
 def solve_bubble(graph: DiGraph,
@@ -244,50 +424,253 @@ def solve_bubble(graph: DiGraph,
     :param descendant_node: (str) A downstream node in the graph
     :return: (nx.DiGraph) A directed graph object
     """
-    # Find all simple paths between the ancestor and descendant
-    all_paths = list(all_simple_paths(graph,
-                                      source=ancestor_node,
-                                      target=descendant_node))
-    # Compute the average weight of the path
-    weight_avgs = [path_average_weight(graph, path) for path in all_paths]
-    # Compute the length of each path
-    path_lengths = [len(path) for path in all_paths]
-    # Choose the best path and remove others
-    graph = select_best_path(graph, all_paths, path_lengths, weight_avgs)
+    # Restrict the search to nodes both reachable from the ancestor and
+    # reaching the descendant
+    nodes = descendants(graph, ancestor_node) & ancestors(graph,
+                                                          descendant_node)
+    paths_to_remove = _bubble_paths_to_remove(graph, ancestor_node,
+                                              descendant_node, nodes)
+    return remove_paths(graph, paths_to_remove, False, False)
 
-    return graph
+
+def _bubble_nodes(graph: DiGraph, ancestor_node: str, descendant_node: str,
+                  rank: Dict[str, int]) -> set:
+    """Get the nodes lying on a path between the two ends of a bubble.
+
+    Searches only follow edges going forward in rank and are bounded by the
+    rank of the bubble ends, so they stay local to the bubble.
+
+    :param graph: (nx.DiGraph) A directed graph object
+    :param ancestor_node: (str) An upstream node in the graph
+    :param descendant_node: (str) A downstream node in the graph
+    :param rank: (dict) Rank of each node, see _acyclic_ranks
+    :return: (set) Nodes of the bubble, empty if the ends are not connected
+    """
+    reachable = []
+    for start, neighbors, in_bounds in (
+        (ancestor_node, graph.successors,
+         lambda node, successor: (rank[node] < rank[successor]
+                                  <= rank[descendant_node])),
+        (descendant_node, graph.predecessors,
+         lambda node, predecessor: (rank[node] > rank[predecessor]
+                                    >= rank[ancestor_node])),
+    ):
+        seen = {start}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for neighbor in neighbors(node):
+                if neighbor not in seen and in_bounds(node, neighbor):
+                    seen.add(neighbor)
+                    stack.append(neighbor)
+        reachable.append(seen)
+    nodes = reachable[0] & reachable[1]
+    return nodes if descendant_node in nodes else set()
+
+
+def _chain_head(graph: DiGraph, node: str, rank: Dict[str, int],
+                chain_heads: Dict[str, str]) -> str:
+    """Go up a chain of nodes with a single predecessor and successor.
+
+    :param graph: (nx.DiGraph) A directed graph object
+    :param node: (str) A node in the graph
+    :param rank: (dict) Rank of each node, chains stop at edges going
+                 backward, see _acyclic_ranks
+    :param chain_heads: (dict) Head found for each node inside a chain,
+                        filled as chains are followed
+    :return: (str) The first node up the chain that is not inside it, the
+             node itself if it is not inside a chain
+    """
+    chain = []
+    while (node not in chain_heads and graph.in_degree(node) == 1
+           and graph.out_degree(node) == 1):
+        predecessor = next(iter(graph.predecessors(node)))
+        if rank[predecessor] >= rank[node]:
+            break
+        chain.append(node)
+        node = predecessor
+    head = chain_heads.get(node, node)
+    for chain_node in chain:
+        chain_heads[chain_node] = head
+    return head
 
 
-def simplify_bubbles(graph: DiGraph) -> DiGraph:
+def _lowest_common_ancestor(graph: DiGraph, node_a: str, node_b: str,
+                            rank: Dict[str, int],
+                            chain_heads: Dict[str, str]):
+    """Find the common ancestor of two nodes ranked last in topological order.
+
+    Nodes count as their own ancestors. Ancestors of both nodes are visited
+    together by decreasing rank, so that the first node reached from both
+    sides is the lowest common ancestor and the search stops there.
+
+    A node inside a non-branching chain is only reached through its
+    successor, which is popped first, so it cannot be the lowest common
+    ancestor: chains are skipped up to their head, as if the graph was
+    compacted into unitigs. Only edges going forward in rank are followed.
+
+    :param graph: (nx.DiGraph) A directed graph object
+    :param node_a: (str) A node in the graph
+    :param node_b: (str) Another node in the graph
+    :param rank: (dict) Rank of each node, see _acyclic_ranks
+    :param chain_heads: (dict) Heads of chains, see _chain_head
+    :return: (str) The lowest common ancestor, None if there is none
+    """
+    # Bit 1 marks ancestors of node_a, bit 2 ancestors of node_b
+    sides = {node_a: 1, node_b: 2}
+    heap = sorted([(-rank[node_a], node_a), (-rank[node_b], node_b)])
+    while heap:
+        # Successors are popped first, so the sides of a node are final
+        _, node = heapq.heappop(heap)
+        if sides[node] == 3:
+            return node
+        for predecessor in graph.predecessors(node):
+            if rank[predecessor] >= rank[node]:
+                continue
+            if predecessor not in sides:
+                predecessor = _chain_head(graph, predecessor, rank,
+                                          chain_heads)
+            if predecessor not in sides:
+                sides[predecessor] = sides[node]
+                heapq.heappush(heap, (-rank[predecessor], predecessor))
+            else:
+                sides[predecessor] |= sides[node]
+    return None
+
+
+def _acyclic_ranks(graph: DiGraph) -> Dict[str, int]:
+    """Rank the nodes of a graph in topological order, leaving cycles out.
+
+    Edges closing a cycle, such as the one of a repeat, are found by a
+    depth-first search from the nodes without predecessors: they lead back
+    to a node still being explored. Nodes are ranked in topological order
+    of the other edges, so that only edges closing a cycle go backward in
+    rank, and bubbles are searched along the edges going forward.
+
+    :param graph: (nx.DiGraph) A directed graph object
+    :return: (dict) Rank of each node, in order of rank
+    """
+    back_edges = []
+    if not is_directed_acyclic_graph(graph):
+        visited, active = set(), set()
+        sources = [node for node in graph if graph.in_degree(node) == 0]
+        for root in itertools.chain(sources, graph):
+            if root in visited:
+                continue
+            visited.add(root)
+            active.add(root)
+            stack = [(root, iter(graph.successors(root)))]
+            while stack:
+                node, successors = stack[-1]
+                for successor in successors:
+                    if successor in active:
+                        back_edges.append((node, successor))
+                    elif successor not in visited:
+                        visited.add(successor)
+                        active.add(successor)
+                        stack.append((successor,
+                                      iter(graph.successors(successor))))
+                        break
+                else:
+                    stack.pop()
+                    active.discard(node)
+    order = topological_sort(restricted_view(graph, [], back_edges))
+    return {node: index for index, node in enumerate(order)}
+
+
+def _pickle_by_value() -> None:
+    """Send the functions of this module to joblib workers by value.
+
+    Workers may not import this module under the same name, for example
+    when it was imported from a sys.path entry. The module is registered
+    with cloudpickle once, the first time bubbles are sent to workers.
+    """
+    if __name__ not in cloudpickle.list_registry_pickle_by_value():
+        cloudpickle.register_pickle_by_value(sys.modules[__name__])
+
+
+def simplify_bubbles(graph: DiGraph, n_jobs: int = 1) -> DiGraph:
     """Detect and explode bubbles
 
+    Every pass collects the bubbles of the graph at once and solves them,
+    then the next pass only looks again at the nodes closing these
+    bubbles, until no bubble is left. Bubbles without common nodes
+    are evaluated together, in parallel if n_jobs is not 1 and joblib is
+    available, before their paths are removed.
+
+    Bubbles only follow edges going forward in rank, so cycles, such as
+    those of repeats, never make a bubble.
+
     :param graph: (nx.DiGraph) A directed graph object
+    :param n_jobs: (int) Number of parallel jobs, -1 for all cores
     :return: (nx.DiGraph) A directed graph object
     """
-    bubble = False
-
-    # Iterate through each node to check for bubbles
-    for node in graph.nodes():
-        # Get the list of predecessors for the current node
-        liste_predecesseurs = list(graph.predecessors(node))
-
-        # If there is more than one predecessor, a potential bubble exists
-        if len(liste_predecesseurs) > 1:
-            # Check each unique combination of predecessors (i, j)
-            for i, j in itertools.combinations(liste_predecesseurs, 2):
-                # Find the lowest common ancestor of the two predecessors
-                noeud_ancetre = lowest_common_ancestor(graph, i, j)
-                # If a common ancestor is found, a bubble exists
-                if noeud_ancetre is not None:
-                    bubble = True
+    # Removing paths keeps edges going forward, ranks are computed once
+    rank = _acyclic_ranks(graph)
+    candidates = list(rank)
+    while candidates:
+        # The graph is not modified while bubbles are collected, so chains
+        # are only followed once
+        chain_heads = {}
+        # Visit merge nodes in topological order so that upstream bubbles
+        # come first
+        bubbles = []
+        for node in candidates:
+            if node not in graph:
+                continue
+            # Check the degree first, most nodes have a single predecessor
+            if graph.in_degree(node) < 2:
+                continue
+            predecessors = [predecessor
+                            for predecessor in graph.predecessors(node)
+                            if rank[predecessor] < rank[node]]
+            for i, j in itertools.combinations(predecessors, 2):
+                ancestor_node = _lowest_common_ancestor(graph, i, j, rank,
+                                                        chain_heads)
+                if ancestor_node is not None:
+                    bubbles.append((ancestor_node, node))
                     break
-            if bubble:
-                break
-
-    # Recursive simplification of the graph
-    if bubble:
-        # Solve the bubble between the ancestor and the current node
-        graph = simplify_bubbles(solve_bubble(graph, noeud_ancetre, node))
+        # Removing paths never creates new common ancestors, so only the
+        # nodes closing a bubble in this pass may close another one
+        candidates = [descendant_node for _, descendant_node in bubbles]
+
+        while bubbles:
+            # Select bubbles that share no node, others wait for next round
+            batch, overlapping, used_nodes = [], [], set()
+            for ancestor_node, descendant_node in bubbles:
+                # Solving a previous bubble may have removed this one
+                if ancestor_node not in graph or descendant_node not in graph:
+                    continue
+                nodes = _bubble_nodes(graph, ancestor_node, descendant_node,
+                                      rank)
+                if not nodes:
+                    continue
+                if nodes & used_nodes:
+                    overlapping.append((ancestor_node, descendant_node))
+                else:
+                    used_nodes |= nodes
+                    batch.append((ancestor_node, descendant_node, nodes))
+            bubbles = overlapping
+
+            if n_jobs != 1 and Parallel is not None and len(batch) > 1:
+                _pickle_by_value()
+                # Each job only receives the subgraph of its bubble
+                removals = Parallel(n_jobs=n_jobs)(
+                    delayed(_bubble_paths_to_remove)(
+                        graph.subgraph(nodes).copy(), ancestor_node,
+                        descendant_node, nodes,
+                        {node: rank[node] for node in nodes}
+                    )
+                    for ancestor_node, descendant_node, nodes in batch
+                )
+            else:
+                removals = [
+                    _bubble_paths_to_remove(graph, ancestor_node,
+                                            descendant_node, nodes, rank)
+                    for ancestor_node, descendant_node, nodes in batch
+                ]
+            for paths_to_remove in removals:
+                graph = remove_paths(graph, paths_to_remove, False, False)
 
     return graph
 
@@ -295,35 +678,39 @@ def simplify_bubbles(graph: DiGraph) -> DiGraph:
 def solve_entry_tips(graph: DiGraph, starting_nodes: List[str]) -> DiGraph:
     """Remove entry tips from the graph.
 
+    Removing tips never adds paths from the starting nodes, so a node that
+    has no tip left is never visited again.
+
     :param graph: (nx.DiGraph) A directed graph object.
     :param starting_nodes: (list) A list of starting nodes.
     :return: (nx.DiGraph) A directed graph object without entry tips.
     """
-    for node in graph.nodes:
-        predecessors = list(graph.predecessors(node))
-        # If node has multiple predecessors, process entry tips
-        if len(predecessors) > 1:
+    for node in list(graph.nodes):
+        while node in graph:
+            # Only nodes with multiple predecessors can have entry tips
+            if graph.in_degree(node) <= 1:
+                break
+            # Paths to the node only go through its ancestors
+            nodes = ancestors(graph, node)
             path_list, path_lengths, weight_avg_list = [], [], []
             for start_node in starting_nodes:
-                if has_path(graph, start_node, node):
+                if start_node in nodes:
                     # Get all simple paths from start_node to node
-                    for path in all_simple_paths(graph, start_node, node):
-                        if len(path) >= 2:
-                            path_list.append(path)
-                            path_lengths.append(len(path))
-                            weight_avg_list.append(path_average_weight(graph,
-                                                                       path))
+                    for path, weight_avg in _weighted_simple_paths(
+                            graph, start_node, {node}, nodes):
+                        path_list.append(path)
+                        path_lengths.append(len(path))
+                        weight_avg_list.append(weight_avg)
 
             # If multiple valid paths exist, select the best one
-            if len(path_list) > 1:
-                graph = select_best_path(graph, path_list,
-                                         path_lengths,
-                                         weight_avg_list,
-                                         delete_entry_node=True,
-                                         delete_sink_node=False)
-
-                # Recursively remove entry tips
-                return solve_entry_tips(graph, get_starting_nodes(graph))
+            if len(path_list) <= 1:
+                break
+            graph = select_best_path(graph, path_list,
+                                     path_lengths,
+                                     weight_avg_list,
+                                     delete_entry_node=True,
+                                     delete_sink_node=False)
+            starting_nodes = get_starting_nodes(graph)
 
     return graph
 
@@ -331,51 +718,53 @@ def solve_entry_tips(graph: DiGraph, starting_nodes: List[str]) -> DiGraph:
 def solve_out_tips(graph: DiGraph, sink_nodes: List[str]) -> DiGraph:
     """Remove out tips from the graph.
 
+    Removing tips never adds paths to the sink nodes, so a node that has
+    no tip left is never visited again.
+
     :param graph: (nx.DiGraph) A directed graph object.
     :param sink_nodes: (list) A list of sink nodes.
     :return: (nx.DiGraph) A directed graph object without out tips.
     """
-    while True:
-        tip_found = False
-        for node in graph.nodes:
-            successors = list(graph.successors(node))
-            # If node has multiple successors, process out tips
-            if len(successors) > 1:
-                path_list, path_lengths, weight_avg_list = [], [], []
-                for sink_node in sink_nodes:
-                    if has_path(graph, node, sink_node):
-                        # Get all simple paths from node to sink_node
-                        for path in all_simple_paths(graph, node, sink_node):
-                            if len(path) >= 2:
-                                path_list.append(path)
-                                path_lengths.append(len(path))
-                                weight_avg_list.append(path_average_weight(graph, path))
-
-                # If multiple valid paths exist, select the best one
-                if len(path_list) > 1:
-                    graph = select_best_path(graph,
-                                             path_list,
-                                             path_lengths,
-                                             weight_avg_list,
-                                             delete_entry_node=False,
-                                             delete_sink_node=True)
-                    tip_found = True
-                    break
+    for node in list(graph.nodes):
+        while node in graph:
+            # Only nodes with multiple successors can have out tips
+            if graph.out_degree(node) <= 1:
+                break
+            # Paths to all the sink nodes are found in a single search,
+            # then grouped by sink node
+            nodes = descendants(graph, node)
+            sink_paths = {sink_node: [] for sink_node in sink_nodes
+                          if sink_node in nodes}
+            for path, weight_avg in _weighted_simple_paths(
+                    graph, node, sink_paths.keys(), nodes):
+                sink_paths[path[-1]].append((path, weight_avg))
+            path_list, path_lengths, weight_avg_list = [], [], []
+            for sink_node in sink_nodes:
+                for path, weight_avg in sink_paths.get(sink_node, []):
+                    path_list.append(path)
+                    path_lengths.append(len(path))
+                    weight_avg_list.append(weight_avg)
 
-        if not tip_found:
-            break
-        sink_nodes = get_sink_nodes(graph)
+            # If multiple valid paths exist, select the best one
+            if len(path_list) <= 1:
+                break
+            graph = select_best_path(graph, path_list,
+                                     path_lengths,
+                                     weight_avg_list,
+                                     delete_entry_node=False,
+                                     delete_sink_node=True)
+            sink_nodes = get_sink_nodes(graph)
 
     return graph
 
 
 def get_starting_nodes(graph: DiGraph) -> List[str]:
     """Get nodes without predecessors
+
     :param graph: (nx.DiGraph) A directed graph object
     :return: (list) A list of all nodes without predecessors
     """
-    return [node for node in graph.nodes()
-            if not list(graph.predecessors(node))]
+    return [node for node, degree in graph.in_degree() if degree == 0]
 
 
 def get_sink_nodes(graph: DiGraph) -> List[str]:
@@ -384,8 +773,73 @@ def get_sink_nodes(graph: DiGraph) -> List[str]:
     :param graph: (nx.DiGraph) A directed graph object
     :return: (list) A list of all nodes without successors
     """
-    return [node for node in graph.nodes()
-            if not list(graph.successors(node))]
+    return [node for node, degree in graph.out_degree() if degree == 0]
+
+
+def _unitig(graph: DiGraph, head: str) -> List[str]:
+    """Follow the chain of non-branching nodes starting at a node.
+
+    :param graph: (nx.DiGraph) A directed graph object
+    :param head: (str) First node of the chain
+    :return: (list) Nodes of the chain, head included
+    """
+    unitig = [head]
+    node = head
+    while graph.out_degree(node) == 1:
+        node = next(iter(graph.successors(node)))
+        if graph.in_degree(node) != 1 or node == head:
+            break
+        unitig.append(node)
+    return unitig
+
+
+def _iter_contigs(
+    graph: DiGraph, starting_nodes: List[str], ending_nodes: List[str]
+    ) -> Iterator[Tuple[bytes, int]]:
+    """Generate the contigs of the graph one at a time
+
+    Each starting node is explored once. Non-branching chains of nodes
+    (unitigs) are compacted the first time they are reached, with the
+    nucleotides they add to a contig, so that paths sharing a chain do not
+    walk it node by node again. A contig is emitted every time an ending
+    node is reached. Contigs are built as bytes, ready to be written.
+
+    :param graph: (nx.DiGraph) A directed graph object
+    :param starting_nodes: (list) A list of nodes without predecessors
+    :param ending_nodes: (list) A list of nodes without successors
+    :return: A generator object of (contiguous sequence, length) tuples
+    """
+    ending_nodes = set(ending_nodes)
+    # Nodes, added nucleotides and ending positions of each unitig
+    unitigs = {}
+    for start_node in starting_nodes:
+        # Start with the first k-mer, then each node only adds its last
+        # nucleotide. Paths keep their nodes to stay simple
+        stack = [([start_node[:-1].encode()], set(), start_node)]
+        while stack:
+            parts, visited, head = stack.pop()
+            if head not in unitigs:
+                nodes = _unitig(graph, head)
+                unitigs[head] = (
+                    nodes, "".join([node[-1] for node in nodes]).encode(),
+                    [i for i, node in enumerate(nodes) if node in ending_nodes]
+                )
+            nodes, suffix, ends = unitigs[head]
+            # Only in cycles: the path stops before its first revisit
+            size = next((i for i, node in enumerate(nodes)
+                         if node in visited), len(nodes))
+            for i in ends:
+                if i < size:
+                    contig = b"".join(parts) + suffix[:i + 1]
+                    yield contig, len(contig)
+            if size < len(nodes):
+                continue
+            parts = parts + [suffix]
+            visited = visited | set(nodes)
+            # Branching node: explore every successor separately
+            for successor in reversed(list(graph.successors(nodes[-1]))):
+                if successor not in visited:
+                    stack.append((parts, visited, successor))
 
 
 def get_contigs(
@@ -398,35 +852,30 @@ def get_contigs(
     :param ending_nodes: (list) A list of nodes without successors
     :return: (list) List of [contiguous sequence and their length]
     """
-    contigs = []
+    return [(contig.decode(), length) for contig, length
+            in _iter_contigs(graph, starting_nodes, ending_nodes)]
 
-    for start_node in starting_nodes:
-        for end_node in ending_nodes:
-            # Get all simple paths from the start node to the end node
-            paths = all_simple_paths(graph, start_node, end_node)
-            for path in paths:
-                # Build the contig from the path
-                # Start with the first k-mer
-                contig = path[0]
-                for node in path[1:]:
-                    # Append only the last nucleotide of each subsequent k-mer
-                    contig += node[-1]
-                # Store contig and its length
-                contigs.append((contig, len(contig)))
-
-    return contigs
-
-
-def save_contigs(contigs_list: List[str], output_file: Path) -> None:
+
+def save_contigs(contigs_list: Iterable[Tuple[Union[str, bytes], int]],
+                 output_file: Path) -> None:
     """Write all contigs in fasta format
 
+    Contigs are written as they come, so a generator can be given to avoid
+    holding all of them in memory. Each record is formatted in a single
+    buffer and written at once.
+
     :param contig_list: (list) List of [contiguous sequence and their length]
     :param output_file: (Path) Path to the output file
     """
-    with output_file.open("w", newline='\n') as file:
+    with output_file.open("wb") as file:
         for i, (contig, length) in enumerate(contigs_list):
-            file.write(f">contig_{i} len={length}\n")
-            file.write(textwrap.fill(contig, 80) + "\n")
+            sequence = contig.encode() if isinstance(contig, str) else contig
+            record = [f">contig_{i} len={length}".encode()]
+            # Sequences have no spaces to wrap on, cut them every 80 bases
+            record.extend(sequence[start:start + _LINE_WIDTH]
+                          for start in range(0, len(sequence), _LINE_WIDTH))
+            record.append(b"")
+            file.write(b"\n".join(record))
 
 
 # ==============================================================
@@ -444,26 +893,27 @@ def main() -> None:  # pragma: no cover
     output_file = args.output_file
 
     # Build the kmer dictionary
-    kmer_dict = build_kmer_dict(fasta_file, kmer_size)
+    kmer_dict = build_kmer_dict(fasta_file, kmer_size, args.canonical,
+                                args.drop_singletons)
 
     # Build the debruijn graph
-    graph = build_graph(kmer_dict)
+    graph = build_graph(kmer_dict, args.canonical)
 
     # Simplify the graph by removing bubbles
-    graph = simplify_bubbles(graph)
-
-    # Get the starting and ending nodes
-    starting_nodes = get_starting_nodes(graph)
-    ending_nodes = get_sink_nodes(graph)
+    graph = simplify_bubbles(graph, args.n_jobs)
 
     # Remove entry tips
-    graph = solve_entry_tips(graph, starting_nodes)
+    graph = solve_entry_tips(graph, get_starting_nodes(graph))
 
     # Remove out tips
-    graph = solve_out_tips(graph, ending_nodes)
+    graph = solve_out_tips(graph, get_sink_nodes(graph))
+
+    # Get the starting and ending nodes left after tip removal
+    starting_nodes = get_starting_nodes(graph)
+    ending_nodes = get_sink_nodes(graph)
 
-    # Get the contigs
-    contigs = get_contigs(graph, starting_nodes, ending_nodes)
+    # Get the contigs as bytes, generated while they are written
+    contigs = _iter_contigs(graph, starting_nodes, ending_nodes)
 
     # Save the contigs in a fasta file
     save_contigs(contigs, output_file)
@@ -0,0 +1,597 @@
+# -*- coding: utf-8 -*-
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    A copy of the GNU General Public License is available at
+#    http://www.gnu.org/licenses/gpl-3.0.html
+
+"""Count the kmers of fastq files as 2-bit packed integers."""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+import numpy as np
+
+try:
+    from numba import get_num_threads, njit, prange
+except ImportError:  # pragma: no cover
+    # The kernels then run as plain Python functions
+    njit = None
+    prange = range  # pylint: disable=invalid-name
+
+    def get_num_threads() -> int:
+        """Number of threads of the counting kernels without numba."""
+        return 1
+
+# 2-bit code of each nucleotide, indexed by its ASCII value, soft-masked
+# lowercase nucleotides included. Other characters, such as N, get a code
+# that no kmer may contain
+_UNKNOWN_BASE = 4
+_BASE = np.full(256, _UNKNOWN_BASE, dtype=np.uint8)
+_BASE[[ord(c) for c in "ACGT"]] = [0, 1, 2, 3]
+_BASE[[ord(c) for c in "acgt"]] = [0, 1, 2, 3]
+_NUCLEOTIDES = "ACGT"
+_LETTERS = np.frombuffer(_NUCLEOTIDES.encode(), dtype=np.uint8)
+# Size of the buffer of fastq files
+_READ_BUFFER_SIZE = 1 << 20
+# Number of reads whose kmers are counted in one call
+_BATCH_SIZE = 4096
+# Number of kmers decoded at once
+_DECODE_SIZE = 1 << 16
+# Initial number of slots of the kmer count table
+_TABLE_SIZE = 1 << 16
+# Multiplier of the Fibonacci hashing of packed kmers
+_FIBONACCI = np.uint64(0x9E3779B97F4A7C15)
+# Number of hash bits selecting the partition of the kmer count table
+_PARTITION_BITS = 6
+# Bits of the Bloom filter of singleton kmers per byte of fastq file. A
+# 100 bp record of about 230 bytes has at most 80 distinct kmers, so at
+# worst about 6 bits per kmer: around 7% of singletons then pass the
+# filter, to be dropped after the exact recount
+_BLOOM_BITS_PER_BYTE = 2
+# Rotations of the kmer hash giving the bits of a kmer in the Bloom filter
+_BLOOM_ROTATIONS = (13, 29, 47)
+
+
+class _CountTable(NamedTuple):
+    """Open-addressing table counting packed kmers, split in partitions.
+
+    Each partition is filled by its own thread. Given a Bloom filter, with
+    one partition per table partition, kmers are only added to the table
+    when seen a second time.
+    """
+    # Kmers of each partition, -1 for empty slots
+    keys: np.ndarray
+    # Occurrences of the kmer in each slot
+    counts: np.ndarray
+    # Position of the first occurrence of the kmer in the fastq file
+    ranks: np.ndarray
+    # Number of kmers in each partition
+    used: np.ndarray
+    # 64 minus the number of bits of the partition size, see _table_slot
+    shift: np.uint64
+    # Bloom filter of each partition, as uint64 words, no words to count
+    # all kmers
+    bloom: np.ndarray
+    # Shift of the filter, see _bloom_add
+    bloom_shift: np.uint64
+    # Size of the kmers, less than 32
+    kmer_size: int
+    # Count canonical kmers, see _kmer_codes
+    canonical: bool
+
+
+def read_sequences(fastq_file: Path) -> Iterator[bytes]:
+    """Extract raw read sequences from a fastq file.
+
+    The file is read in binary mode through a large buffer, and every
+    fourth line is taken with islice, so that lines are neither decoded
+    nor handled one by one in Python.
+
+    :param fastq_file: (Path) Path to the fastq file.
+    :return: A generator object that iterates over the read sequences.
+    """
+    with fastq_file.open("rb", buffering=_READ_BUFFER_SIZE) as file:
+        # Sequences are the second line of each 4-line record
+        for sequence in itertools.islice(file, 1, None, 4):
+            yield sequence.rstrip()
+
+
+
+def _decode_kmer(code: int, kmer_size: int) -> str:
+    """Decode a 2-bit packed kmer into its nucleotide sequence.
+
+    :param code: (int) Packed kmer, first nucleotide in the highest bits
+    :param kmer_size: (int) Size of the kmer
+    :return: (str) Nucleotide sequence of the kmer
+    """
+    return "".join(_NUCLEOTIDES[(code >> (2 * i)) & 3]
+                   for i in range(kmer_size - 1, -1, -1))
+
+
+def _decode_kmers(codes: np.ndarray, kmer_size: int) -> List[str]:
+    """Decode 2-bit packed kmers into their nucleotide sequences.
+
+    Kmers are decoded at once by slices of _DECODE_SIZE, so that the
+    arrays of a slice stay small beside the list of strings.
+
+    :param codes: (np.ndarray) Packed kmers, as uint64
+    :param kmer_size: (int) Size of the kmers, at most 32
+    :return: (list) Nucleotide sequence of each kmer
+    """
+    shifts = np.arange(2 * (kmer_size - 1), -1, -2, dtype=np.uint64)
+    kmers = []
+    for start in range(0, codes.size, _DECODE_SIZE):
+        # One row of ASCII letters per kmer, read back as fixed-size strings
+        letters = _LETTERS[(codes[start:start + _DECODE_SIZE, None] >> shifts)
+                           & np.uint64(3)]
+        kmers.extend(letters.view(f"S{kmer_size}")[:, 0]
+                     .astype(f"U{kmer_size}").tolist())
+    return kmers
+
+
+def _kmer_codes(codes, ends, kmer_size, canonical, kmers) -> int:
+    """Pack the kmers of a batch of reads with a rolling hash.
+
+    This is the only loop rolling kmers: it is compiled with numba for the
+    count table, and run as Python with an object array for kmers that do
+    not fit in 64 bits.
+
+    :param codes: Nucleotide codes (0-3, or unknown) of the concatenated
+                  reads
+    :param ends: End offset of each read in codes
+    :param kmer_size: (int) Size of the kmers
+    :param canonical: (bool) Pack the smallest of each kmer and its
+                      reverse complement
+    :param kmers: (np.ndarray) Packed kmers, filled in order of occurrence,
+                  one slot per nucleotide code is enough
+    :return: (int) Number of kmers packed
+    """
+    mask = (1 << (2 * kmer_size)) - 1
+    high = 2 * (kmer_size - 1)
+    count = start = 0
+    for end in ends:
+        # Nucleotides rolled since the start of the read or the last N
+        code = reverse = size = 0
+        for i in range(start, end):
+            if codes[i] == _UNKNOWN_BASE:
+                # Kmers never span an unknown nucleotide, start over
+                size = 0
+                continue
+            # Drop the oldest nucleotide and shift in the new one
+            code = ((code << 2) & mask) | codes[i]
+            # The reverse complement gets the complement at the other end
+            reverse = (reverse >> 2) | ((3 - codes[i]) << high)
+            size += 1
+            if size >= kmer_size:
+                kmers[count] = min(code, reverse) if canonical else code
+                count += 1
+        start = end
+    return count
+
+
+def _batch_kmer_counts(codes, ends, kmer_size,
+                       canonical=False) -> Dict[int, int]:
+    """Count the 2-bit packed kmers of a batch of reads with NumPy.
+
+    The kmers starting at every position are packed at once, one shift per
+    nucleotide of the kmer, then those overlapping two reads or containing
+    an unknown nucleotide are dropped.
+
+    :param codes: (np.ndarray) Nucleotide codes (0-3, or unknown) of the
+                  concatenated reads
+    :param ends: (np.ndarray) End offset of each read in codes
+    :param kmer_size: (int) Size of the kmers, at most 32
+    :param canonical: (bool) Count the smallest of each kmer and its
+                      reverse complement
+    :return: (dict) Occurrences of each packed kmer, in order of first
+             occurrence
+    """
+    positions = codes.size - kmer_size + 1
+    if positions <= 0:
+        return {}
+    values = (codes & 3).astype(np.uint64)
+    kmers = np.zeros(positions, dtype=np.uint64)
+    for i in range(kmer_size):
+        kmers = (kmers << np.uint64(2)) | values[i:i + positions]
+    if canonical:
+        reverse = np.zeros(positions, dtype=np.uint64)
+        for i in range(kmer_size):
+            reverse |= ((np.uint64(3) - values[i:i + positions])
+                        << np.uint64(2 * i))
+        kmers = np.minimum(kmers, reverse)
+    # Keep the kmers ending before the end of the read they start in
+    keep = (np.arange(positions) + kmer_size
+            <= np.repeat(ends, np.diff(ends, prepend=0))[:positions])
+    # and without unknown nucleotide, counted before each position
+    unknown = np.concatenate(([0], np.cumsum(codes == _UNKNOWN_BASE)))
+    keep &= unknown[kmer_size:] == unknown[:positions]
+    kmers = kmers[keep]
+    unique, first, counts = np.unique(kmers, return_index=True,
+                                      return_counts=True)
+    order = np.argsort(first)
+    return dict(zip(unique[order].tolist(), counts[order].tolist()))
+
+
+def _table_shift(size: int) -> np.uint64:
+    """Get the hash shift of a partition of the kmer count table.
+
+    :param size: (int) Number of slots of the partition, a power of two
+    :return: (np.uint64) 64 minus the number of bits of the partition size
+    """
+    return np.uint64(65 - size.bit_length())
+
+
+def _kmer_hash(code) -> np.uint64:
+    """Hash a packed kmer with Fibonacci hashing.
+
+    The top _PARTITION_BITS bits of the hash select the partition of the
+    count table holding the kmer, the following bits its first slot.
+
+    :param code: (int) Packed kmer
+    :return: (np.uint64) Hash of the kmer
+    """
+    return np.uint64(code) * _FIBONACCI
+
+
+def _table_partition(kmer_hash, partitions):
+    """Get the partition of the count table holding a kmer.
+
+    :param kmer_hash: (np.uint64) Hash of the kmer
+    :param partitions: (int) Number of partitions, a power of two
+    :return: (int) Index of the partition
+    """
+    return (np.int64(kmer_hash >> np.uint64(64 - _PARTITION_BITS))
+            & (partitions - 1))
+
+
+def _table_slot(kmer_hash, code, keys, shift):
+    """Find the slot of a packed kmer in a partition of the count table.
+
+    The first slot is given by the hash of the kmer, then slots are probed
+    linearly.
+
+    :param kmer_hash: (np.uint64) Hash of the kmer
+    :param code: (int) Packed kmer
+    :param keys: (np.ndarray) Kmers of the partition, -1 for empty slots
+    :param shift: (np.uint64) 64 minus the number of bits of the size
+    :return: (int) Slot holding the kmer, or the empty slot where it goes
+    """
+    slot = np.int64((kmer_hash << np.uint64(_PARTITION_BITS)) >> shift)
+    while keys[slot] != -1 and keys[slot] != code:
+        slot = (slot + 1) & (keys.size - 1)
+    return slot
+
+
+def _bloom_add(kmer_hash, bloom, shift) -> bool:
+    """Add a kmer to a partition of a Bloom filter.
+
+    :param kmer_hash: (np.uint64) Hash of the kmer, rotated to get its bits
+    :param bloom: (np.ndarray) Bits of the partition, as uint64 words
+    :param shift: (np.uint64) 64 minus the number of bits of the partition
+    :return: (bool) True if all the bits were already set, the kmer was
+             probably added before
+    """
+    seen = True
+    for rotation in _BLOOM_ROTATIONS:
+        bit = ((kmer_hash << np.uint64(rotation))
+               | (kmer_hash >> np.uint64(64 - rotation))) >> shift
+        flag = np.uint64(1) << (bit & np.uint64(63))
+        word = bit >> np.uint64(6)
+        if not bloom[word] & flag:
+            seen = False
+            bloom[word] |= flag
+    return seen
+
+
+def _partition_kmers(kmers, partitions):
+    """Sort the kmers of a batch by table partition with a counting sort.
+
+    The sort is stable, kmers of a partition stay in order of occurrence.
+
+    :param kmers: (np.ndarray) Packed kmers of the batch
+    :param partitions: (int) Number of partitions, a power of two
+    :return: (tuple) Index of the kmers in the batch sorted by partition,
+             and start of each partition in the sorted kmers, followed by
+             the number of kmers
+    """
+    parts = np.empty(kmers.size, dtype=np.int64)
+    starts = np.zeros(partitions + 1, dtype=np.int64)
+    for i, kmer in enumerate(kmers):
+        parts[i] = _table_partition(_kmer_hash(kmer), partitions)
+        starts[parts[i] + 1] += 1
+    starts = np.cumsum(starts)
+    ends = starts[:-1].copy()
+    order = np.empty(kmers.size, dtype=np.int64)
+    for i, part in enumerate(parts):
+        order[ends[part]] = i
+        ends[part] += 1
+    return order, starts
+
+
+def _count_kmer_codes(kmers, positions, starts, table, recount):
+    """Count the packed kmers of a batch of reads in the count table.
+
+    The open-addressing table can be compiled with numba. Its partitions
+    are filled in parallel: kmers are sorted by partition beforehand, see
+    _partition_kmers, and each thread only goes over the kmers of its own
+    partition, so that no lock nor merge is needed. When recounting, kmers
+    are not added and the rank of a kmer is set again when it is first
+    counted.
+
+    :param kmers: (np.ndarray) Packed kmers of the batch, sorted by
+                  partition
+    :param positions: (np.ndarray) Position of each kmer in the fastq
+                      file, beyond the number of kmers of the previous
+                      batches
+    :param starts: (np.ndarray) Start of each partition in the kmers,
+                   followed by the number of kmers
+    :param table: (_CountTable) Count table, updated
+    :param recount: (bool) Only count the kmers already in the table
+    """
+    keys, counts, ranks = table.keys, table.counts, table.ranks
+    for part in prange(keys.shape[0]):
+        for i in range(starts[part], starts[part + 1]):
+            kmer = kmers[i]
+            kmer_hash = _kmer_hash(kmer)
+            slot = _table_slot(kmer_hash, kmer, keys[part], table.shift)
+            if keys[part, slot] == -1:
+                if recount:
+                    continue
+                # Only add kmers already seen, if filtering singletons
+                if (table.bloom.shape[1]
+                        and not _bloom_add(kmer_hash, table.bloom[part],
+                                           table.bloom_shift)):
+                    continue
+                keys[part, slot] = kmer
+                ranks[part, slot] = positions[i]
+                table.used[part] += 1
+            elif recount and counts[part, slot] == 0:
+                ranks[part, slot] = positions[i]
+            counts[part, slot] += 1
+
+
+def _grow_table(keys, counts, ranks, shift):
+    """Move the kmers of a count table to a table twice as large.
+
+    :param keys: (np.ndarray) Kmers of each partition, see _CountTable
+    :param counts: (np.ndarray) Occurrences of the kmer in each slot
+    :param ranks: (np.ndarray) Position of the first occurrence of the kmer
+    :param shift: (np.uint64) Shift of the new table, see _table_slot
+    :return: (tuple) Kmers, occurrences and ranks of the new table
+    """
+    partitions, size = keys.shape
+    new_keys = np.full((partitions, 2 * size), -1, dtype=np.int64)
+    new_counts = np.zeros((partitions, 2 * size), dtype=np.uint32)
+    new_ranks = np.zeros((partitions, 2 * size), dtype=np.int64)
+    for part in prange(partitions):
+        for i in range(size):
+            if keys[part, i] != -1:
+                slot = _table_slot(_kmer_hash(keys[part, i]), keys[part, i],
+                                   new_keys[part], shift)
+                new_keys[part, slot] = keys[part, i]
+                new_counts[part, slot] = counts[part, i]
+                new_ranks[part, slot] = ranks[part, i]
+    return new_keys, new_counts, new_ranks
+
+
+# The Python function is kept to roll kmers too large for 64 bits
+_compiled_kmer_codes = _kmer_codes
+if njit is not None:
+    _kmer_hash = njit(cache=True)(_kmer_hash)
+    _table_partition = njit(cache=True)(_table_partition)
+    _table_slot = njit(cache=True)(_table_slot)
+    _bloom_add = njit(cache=True)(_bloom_add)
+    _compiled_kmer_codes = njit(cache=True, nogil=True)(_kmer_codes)
+    _partition_kmers = njit(cache=True, nogil=True)(_partition_kmers)
+    _count_kmer_codes = njit(cache=True, nogil=True,
+                             parallel=True)(_count_kmer_codes)
+    _grow_table = njit(cache=True, nogil=True, parallel=True)(_grow_table)
+
+
+def _count_batch(table: _CountTable, codes: np.ndarray, ends: np.ndarray,
+                 offset: int, recount: bool = False) -> _CountTable:
+    """Count the kmers of a batch of reads in the compiled count table.
+
+    The table is grown first so that each partition stays at most half
+    full whatever the number of new kmers in the batch.
+
+    :param table: (_CountTable) Count table
+    :param codes: (np.ndarray) Nucleotide codes (0-3, or unknown) of the
+                  concatenated reads
+    :param ends: (np.ndarray) End offset of each read in codes
+    :param offset: (int) Position of the batch in the fastq file
+    :param recount: (bool) Only count the kmers already in the table
+    :return: (_CountTable) The table, grown if needed
+    """
+    kmers = np.empty(codes.size, dtype=np.int64)
+    kmers = kmers[:_compiled_kmer_codes(codes, ends, table.kmer_size,
+                                        table.canonical, kmers)]
+    order, starts = _partition_kmers(kmers, table.keys.shape[0])
+    if not recount:
+        sizes = np.diff(starts)
+        while 2 * (table.used + sizes).max() > table.keys.shape[1]:
+            shift = _table_shift(2 * table.keys.shape[1])
+            keys, counts, ranks = _grow_table(table.keys, table.counts,
+                                              table.ranks, shift)
+            table = table._replace(keys=keys, counts=counts, ranks=ranks,
+                                   shift=shift)
+    _count_kmer_codes(kmers[order], offset + order, starts, table, recount)
+    return table
+
+
+def _iter_batches(fastq_file: Path) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Generate the reads of a fastq file by batches of nucleotide codes.
+
+    :param fastq_file: (Path) Path to the fastq file.
+    :return: A generator object of (nucleotide codes of the concatenated
+             reads, end offset of each read) tuples
+    """
+    reads = read_sequences(fastq_file)
+    for batch in iter(lambda: list(itertools.islice(reads, _BATCH_SIZE)), []):
+        yield (_BASE[np.frombuffer(b"".join(batch), dtype=np.uint8)],
+               np.cumsum([len(read) for read in batch]))
+
+
+def _count_batches(fastq_file: Path, table: _CountTable,
+                   recount: bool = False) -> _CountTable:
+    """Count the kmers of all the reads of a fastq file, see _count_batch.
+
+    Batches are counted by a background thread while the next one is read,
+    the compiled kernels release the GIL.
+
+    :param fastq_file: (Path) Path to the fastq file.
+    :param table: (_CountTable) Count table
+    :param recount: (bool) Only count the kmers already in the table
+    :return: (_CountTable) The table, grown if needed
+    """
+    offset = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        counting = None
+        for codes, ends in _iter_batches(fastq_file):
+            if counting is not None:
+                table = counting.result()
+            counting = executor.submit(_count_batch, table, codes, ends,
+                                       offset, recount)
+            offset += codes.size
+        if counting is not None:
+            table = counting.result()
+    return table
+
+
+def _count_kmers_compiled(fastq_file: Path, kmer_size: int, canonical: bool,
+                          drop_singletons: bool
+                          ) -> Tuple[np.ndarray, np.ndarray]:
+    """Count the kmers of a fastq file in the compiled count table.
+
+    Kmers are counted in an open-addressing table of int64 keys and uint32
+    counts rather than a dictionnary, with one partition of the table per
+    thread. To drop singletons, kmers first go through a Bloom filter and
+    only enter the table when seen again, then the reads are read a second
+    time to count the kmers of the table exactly, as in BFCounter.
+
+    :param fastq_file: (Path) Path to the fastq file.
+    :param kmer_size: (int) Size of the kmers, less than 32
+    :param canonical: (bool) Count canonical kmers, see _kmer_codes
+    :param drop_singletons: (bool) Only add kmers seen twice to the table
+    :return: (tuple) Packed kmers and their occurrences, in order of first
+             occurrence
+    """
+    # One partition per thread, a power of two for _table_partition
+    partitions = min(1 << (get_num_threads() - 1).bit_length(),
+                     1 << _PARTITION_BITS)
+    size = _TABLE_SIZE // partitions
+    words = 0
+    if drop_singletons:
+        words = max(fastq_file.stat().st_size * _BLOOM_BITS_PER_BYTE
+                    // (64 * partitions), 1)
+        words = 1 << (words - 1).bit_length()
+    table = _CountTable(
+        keys=np.full((partitions, size), -1, dtype=np.int64),
+        counts=np.zeros((partitions, size), dtype=np.uint32),
+        ranks=np.zeros((partitions, size), dtype=np.int64),
+        used=np.zeros(partitions, dtype=np.int64),
+        shift=_table_shift(size),
+        bloom=np.zeros((partitions, words), dtype=np.uint64),
+        bloom_shift=_table_shift(64 * max(words, 1)),
+        kmer_size=kmer_size,
+        canonical=canonical
+    )
+    table = _count_batches(fastq_file, table)
+    if drop_singletons:
+        # Kmers seen twice passed the filter, along with a few false
+        # positive singletons: count them all again exactly
+        table.counts[:] = 0
+        _count_batches(fastq_file, table, recount=True)
+    # Restore the order of first occurrence, as with a dictionnary
+    filled = table.keys != -1
+    order = np.argsort(table.ranks[filled], kind="stable")
+    return table.keys[filled][order], table.counts[filled][order]
+
+
+def _count_kmers_numpy(fastq_file: Path, kmer_size: int,
+                       canonical: bool) -> Counter:
+    """Count the kmers of a fastq file with NumPy, batch by batch.
+
+    :param fastq_file: (Path) Path to the fastq file.
+    :param kmer_size: (int) Size of the kmers, at most 32
+    :param canonical: (bool) Count canonical kmers, see _kmer_codes
+    :return: (Counter) Occurrences of each packed kmer, in order of first
+             occurrence
+    """
+    kmer_counts = Counter()
+    for codes, ends in _iter_batches(fastq_file):
+        kmer_counts.update(_batch_kmer_counts(codes, ends, kmer_size,
+                                              canonical))
+    return kmer_counts
+
+
+def _count_kmers_python(fastq_file: Path, kmer_size: int,
+                        canonical: bool) -> Counter:
+    """Count the kmers of a fastq file as Python integers.
+
+    Kmers that do not fit in 64 bits are rolled as Python integers. Counter
+    increments in C, only the rolling hash is in Python.
+
+    :param fastq_file: (Path) Path to the fastq file.
+    :param kmer_size: (int) Size of the kmers
+    :param canonical: (bool) Count canonical kmers, see _kmer_codes
+    :return: (Counter) Occurrences of each packed kmer, in order of first
+             occurrence
+    """
+    kmer_counts = Counter()
+    for codes, ends in _iter_batches(fastq_file):
+        kmers = np.empty(codes.size, dtype=object)
+        count = _kmer_codes(codes.tolist(), ends.tolist(), kmer_size,
+                            canonical, kmers)
+        kmer_counts.update(kmers[:count].tolist())
+    return kmer_counts
+
+
+def count_kmers(fastq_file: Path, kmer_size: int, canonical: bool = False,
+                drop_singletons: bool = False) -> Dict[str, int]:
+    """Count the occurrences of all the kmers of a fastq file.
+
+    Kmers are counted as 2-bit packed integers updated with a rolling hash,
+    and only decoded back to strings, all at once, when counting is over.
+    Reads are processed by batches. When numba is available, the counting
+    loop is compiled, see _count_kmers_compiled. Otherwise the kmers of a
+    batch are counted at once with NumPy.
+
+    :param fastq_file: (Path) Path to the fastq file.
+    :param kmer_size: (int) Size of the kmers
+    :param canonical: (bool) Count each kmer with its reverse complement,
+                      under the smallest of both
+    :param drop_singletons: (bool) Leave out kmers seen only once
+    :return: (dict) Occurrences of each kmer, in order of first occurrence
+    """
+    min_count = 2 if drop_singletons else 1
+    # Packed kmers must fit in a signed 64-bit integer to be compiled
+    if njit is not None and kmer_size < 32:
+        codes, counts = _count_kmers_compiled(fastq_file, kmer_size,
+                                              canonical, drop_singletons)
+        kept = counts >= min_count
+        codes, counts = codes[kept], counts[kept].tolist()
+    else:
+        if kmer_size <= 32:
+            kmer_counts = _count_kmers_numpy(fastq_file, kmer_size,
+                                             canonical)
+        else:
+            kmer_counts = _count_kmers_python(fastq_file, kmer_size,
+                                              canonical)
+        codes = [code for code, count in kmer_counts.items()
+                 if count >= min_count]
+        counts = [count for count in kmer_counts.values()
+                  if count >= min_count]
+    if kmer_size <= 32:
+        kmers = _decode_kmers(np.asarray(codes, dtype=np.uint64), kmer_size)
+    else:
+        kmers = [_decode_kmer(code, kmer_size) for code in codes]
+    return dict(zip(kmers, counts))
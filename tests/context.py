@@ -6,3 +6,4 @@ sys.path.insert(
     0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../debruijn"))
 )
 import debruijn
+import kmer_counting
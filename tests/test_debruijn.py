@@ -3,9 +3,11 @@ import pytest
 import os
 import networkx as nx
 import hashlib
+import random
+from collections import Counter
 from pathlib import Path
 from .test_fixtures import global_data
-from .context import debruijn
+from .context import debruijn, kmer_counting
 from debruijn import read_fastq
 from debruijn import cut_kmer
 from debruijn import build_kmer_dict
@@ -58,6 +60,108 @@ def test_build_kmer_dict(global_data):
     global_data.grade += 2
 
 
+def test_build_kmer_dict_unknown_nucleotide(tmp_path):
+    """Test that kmers spanning an N are not counted"""
+    fastq_file = tmp_path / "test_n.fq"
+    fastq_file.write_text("@read\nACGNACGT\n+\nJJJJJJJJ\n")
+    kmer_dict = build_kmer_dict(fastq_file, 3)
+    assert kmer_dict == {"ACG": 2, "CGT": 1}
+    # Lowercase nucleotides are counted as uppercase ones
+    fastq_file.write_text("@read\nacgtACGT\n+\nJJJJJJJJ\n")
+    kmer_dict = build_kmer_dict(fastq_file, 3)
+    assert kmer_dict == {"ACG": 2, "CGT": 2, "GTA": 1, "TAC": 1}
+
+
+def test_build_kmer_dict_drop_singletons():
+    """Test that kmers seen once are left out"""
+    kmer_dict = build_kmer_dict(Path(__file__).parent / "test_build.fq", 3,
+                                drop_singletons=True)
+    assert kmer_dict == {"AGA": 2}
+
+
+def test_build_kmer_dict_canonical():
+    """Test kmer dict of canonical kmers and graph of both strands"""
+    kmer_dict = build_kmer_dict(Path(__file__).parent / "test_build.fq", 3,
+                                canonical=True)
+    # GAG is counted as its reverse complement CTC
+    assert kmer_dict == {"TCA": 1, "CAG": 1, "AGA": 2, "CTC": 1}
+    graph = build_graph({"AGA": 2}, canonical=True)
+    assert graph.edges["AG", "GA"]["weight"] == 2
+    # Reverse complement TCT
+    assert graph.edges["TC", "CT"]["weight"] == 2
+
+
+def _random_reads(seed=1):
+    """Reads of random nucleotides, with a few N"""
+    rng = random.Random(seed)
+    reads = ["".join(rng.choice("ACGT") for _ in range(rng.randint(20, 80)))
+             for _ in range(40)]
+    # Repeat some reads so that kmers are counted more than once
+    reads += reads[:10]
+    return ["".join("N" if rng.random() < 0.02 else base for base in read)
+            for read in reads]
+
+
+def _write_fastq(fastq_file, reads):
+    fastq_file.write_text("".join(f"@read{i}\n{read}\n+\n{'J' * len(read)}\n"
+                                  for i, read in enumerate(reads)))
+    return fastq_file
+
+
+def _cut_kmer_counts(reads, kmer_size, canonical):
+    """Occurrences of the kmers without N, in order of first occurrence"""
+    counts = Counter()
+    for read in reads:
+        for kmer in cut_kmer(read, kmer_size):
+            if "N" in kmer:
+                continue
+            if canonical:
+                reverse = kmer.translate(str.maketrans("ACGT", "TGCA"))[::-1]
+                kmer = min(kmer, reverse)
+            counts[kmer] += 1
+    return list(counts.items())
+
+
+def _decode_counts(kmer_counts, kmer_size):
+    return [(kmer_counting._decode_kmer(code, kmer_size), count)
+            for code, count in kmer_counts.items()]
+
+
+@pytest.mark.parametrize("kmer_size", [3, 21, 32])
+@pytest.mark.parametrize("canonical", [False, True])
+def test_count_kmers_numpy(tmp_path, kmer_size, canonical):
+    """Test the NumPy counting used without numba against cut_kmer"""
+    reads = _random_reads()
+    fastq_file = _write_fastq(tmp_path / "reads.fq", reads)
+    kmer_counts = kmer_counting._count_kmers_numpy(fastq_file, kmer_size,
+                                              canonical)
+    assert (_decode_counts(kmer_counts, kmer_size)
+            == _cut_kmer_counts(reads, kmer_size, canonical))
+
+
+@pytest.mark.parametrize("canonical", [False, True])
+def test_count_kmers_python(tmp_path, canonical):
+    """Test the counting of kmers larger than 64 bits against cut_kmer"""
+    reads = _random_reads()
+    fastq_file = _write_fastq(tmp_path / "reads.fq", reads)
+    kmer_counts = kmer_counting._count_kmers_python(fastq_file, 33, canonical)
+    assert (_decode_counts(kmer_counts, 33)
+            == _cut_kmer_counts(reads, 33, canonical))
+    kmer_dict = build_kmer_dict(fastq_file, 33, canonical=canonical)
+    assert list(kmer_dict.items()) == _cut_kmer_counts(reads, 33, canonical)
+
+
+@pytest.mark.parametrize("kmer_size", [3, 21, 31])
+@pytest.mark.parametrize("canonical", [False, True])
+def test_build_kmer_dict_cut_kmer(tmp_path, kmer_size, canonical):
+    """Test that every counting path matches cut_kmer, in the same order"""
+    reads = _random_reads()
+    fastq_file = _write_fastq(tmp_path / "reads.fq", reads)
+    kmer_dict = build_kmer_dict(fastq_file, kmer_size, canonical=canonical)
+    assert list(kmer_dict.items()) == _cut_kmer_counts(reads, kmer_size,
+                                                       canonical)
+
+
 def test_build_graph(global_data):
     """Test build graph"""
     kmer_dict = {"GAG": 1, "CAG": 1, "AGA": 2, "TCA": 1}
@@ -120,6 +224,45 @@ def test_get_contigs(global_data):
     global_data.grade += 3
 
 
+def test_get_contigs_shared_unitig(monkeypatch):
+    # Both branches of the diamond share the unitig TA-AC-CC, AC ends contigs
+    # in its middle and CT leads back to the start of the path
+    graph = nx.DiGraph()
+    graph.add_edges_from(
+        [
+            ("TC", "CA"),
+            ("CA", "AG"),
+            ("AG", "GT"),
+            ("GT", "TA"),
+            ("CA", "AT"),
+            ("AT", "TT"),
+            ("TT", "TA"),
+            ("TA", "AC"),
+            ("AC", "CC"),
+            ("CC", "CG"),
+            ("CG", "GA"),
+            ("CC", "CT"),
+            ("CT", "TC"),
+        ]
+    )
+    heads = []
+    unitig = debruijn._unitig
+    monkeypatch.setattr(debruijn, "_unitig",
+                        lambda graph, head: heads.append(head)
+                        or unitig(graph, head))
+    contig_list = get_contigs(graph, ["TC"], ["GA", "AC", "CT"])
+    assert contig_list == [
+        ("TCAGTAC", 7),
+        ("TCAGTACCGA", 10),
+        ("TCAGTACCT", 9),
+        ("TCATTAC", 7),
+        ("TCATTACCGA", 10),
+        ("TCATTACCT", 9),
+    ]
+    # Each unitig is only followed once
+    assert sorted(heads) == ["AG", "AT", "CG", "CT", "TA", "TC"]
+
+
 def test_save_contigs(global_data):
     test_file = Path(__file__).parent / "test.fna"
     contig = [("TCAGCGAT", 8), ("TCAGCGAA", 8), ("ACAGCGAT", 8), ("ACAGCGAA", 8)]
@@ -141,6 +284,26 @@ def test_path_weight(global_data):
     global_data.grade += 1
 
 
+def test_path_weight_shortcut():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from(
+        [(1, 2, 5), (2, 4, 10), (4, 5, 3), (1, 5, 100)]
+    )
+    # The (1, 5) edge joins two path nodes but is not on the path
+    assert path_average_weight(graph, [1, 2, 4, 5]) == 6.0
+
+
+def test_path_weight_updated_graph():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 5), (2, 3, 5)])
+    assert path_average_weight(graph, [1, 2, 3]) == 5.0
+    graph[1][2]["weight"] = 100
+    assert path_average_weight(graph, [1, 2, 3]) == 52.5
+    graph.remove_edge(1, 2)
+    graph.add_edge(1, 2, weight=1)
+    assert path_average_weight(graph, [1, 2, 3]) == 3.0
+
+
 def test_remove_paths(global_data):
     graph_1 = nx.DiGraph()
     graph_2 = nx.DiGraph()
@@ -221,6 +384,16 @@ def test_select_best_path(global_data):
     global_data.grade += 4
 
 
+def test_select_best_path_tie():
+    graph_1 = nx.DiGraph()
+    graph_1.add_edges_from([(1, 2), (2, 4), (4, 5), (2, 8), (8, 5), (5, 6)])
+    # Same weight and length: the smallest path is kept
+    graph_1 = select_best_path(graph_1, [[2, 8, 5], [2, 4, 5]], [3, 3], [10, 10])
+    assert (2, 4) in graph_1.edges()
+    assert (4, 5) in graph_1.edges()
+    assert 8 not in graph_1.nodes()
+
+
 def test_solve_bubble(global_data):
     graph_1 = nx.DiGraph()
     graph_1.add_weighted_edges_from(
@@ -303,6 +476,82 @@ def test_simplify_bubbles(global_data):
     global_data.grade += 1
 
 
+def test_simplify_bubbles_parallel():
+    graph_1 = nx.DiGraph()
+    graph_1.add_weighted_edges_from(
+        [
+            (1, 2, 10),
+            (2, 3, 10),
+            (1, 4, 2),
+            (4, 3, 2),
+            (5, 6, 10),
+            (6, 7, 10),
+            (5, 8, 2),
+            (8, 7, 2),
+        ]
+    )
+    graph_1 = simplify_bubbles(graph_1, n_jobs=2)
+    assert (1, 4) not in graph_1.edges()
+    assert (5, 8) not in graph_1.edges()
+    assert (1, 2) in graph_1.edges()
+    assert (5, 6) in graph_1.edges()
+
+
+def test_simplify_bubbles_cycle():
+    graph_1 = nx.DiGraph()
+    graph_1.add_weighted_edges_from(
+        [
+            (1, 2, 10),
+            (2, 3, 10),
+            (1, 4, 2),
+            (4, 3, 2),
+            (3, 5, 10),
+            (5, 6, 10),
+            (6, 5, 10),
+            (7, 6, 2),
+        ]
+    )
+    graph_1 = simplify_bubbles(graph_1)
+    # The bubble next to the cycle is solved, the cycle is left intact even
+    # with a merge node on it
+    assert set(graph_1.edges()) == {(1, 2), (2, 3), (3, 5), (5, 6), (6, 5),
+                                    (7, 6)}
+    graph_2 = nx.DiGraph()
+    graph_2.add_weighted_edges_from(
+        [(1, 2, 10), (2, 3, 10), (1, 4, 2), (4, 3, 2), (3, 1, 10)]
+    )
+    graph_2 = simplify_bubbles(graph_2)
+    # A bubble on a cycle, as made by a repeat, is solved as well
+    assert set(graph_2.edges()) == {(1, 2), (2, 3), (3, 1)}
+
+
+def test_simplify_bubbles_chains():
+    # Branches are chains of several nodes with a single predecessor and
+    # successor, skipped up to their head when looking for the ancestor
+    graph_1 = nx.DiGraph()
+    graph_1.add_weighted_edges_from(
+        [
+            (0, 1, 10),
+            (1, 2, 10),
+            (2, 3, 10),
+            (3, 4, 10),
+            (4, 9, 10),
+            (1, 5, 2),
+            (5, 6, 2),
+            (6, 7, 2),
+            (7, 8, 2),
+            (8, 9, 2),
+            (1, 10, 3),
+            (10, 11, 3),
+            (11, 9, 3),
+            (9, 12, 10),
+        ]
+    )
+    graph_1 = simplify_bubbles(graph_1)
+    assert set(graph_1.edges()) == {(0, 1), (1, 2), (2, 3), (3, 4), (4, 9),
+                                    (9, 12)}
+
+
 def test_solve_entry_tips(global_data):
     graph_1 = nx.DiGraph()
     graph_1.add_weighted_edges_from([(1, 2, 10), (3, 2, 2), (2, 4, 15), (4, 5, 15)])
@@ -320,6 +569,30 @@ def test_solve_entry_tips(global_data):
     global_data.grade += 4
 
 
+def test_solve_entry_tips_chains():
+    graph_1 = nx.DiGraph()
+    graph_1.add_weighted_edges_from(
+        [
+            (1, 2, 10),
+            (2, 3, 10),
+            (3, 4, 10),
+            (4, 9, 10),
+            (5, 6, 2),
+            (6, 7, 2),
+            (7, 8, 2),
+            (8, 9, 2),
+            (10, 11, 3),
+            (11, 12, 3),
+            (12, 8, 3),
+            (9, 13, 10),
+            (13, 14, 10),
+        ]
+    )
+    graph_1 = solve_entry_tips(graph_1, [1, 5, 10])
+    assert set(graph_1.edges()) == {(1, 2), (2, 3), (3, 4), (4, 9), (9, 13),
+                                    (13, 14)}
+
+
 def test_solve_out_tips(global_data):
     graph_1 = nx.DiGraph()
     graph_1.add_weighted_edges_from(